@@ -1,9 +1,11 @@
 # ESP32-S3 MicroPython — Accurate IST Web Clock (UTC math in browser)
 # - NTP: time.google.com
 # - LED: PWM "breathing" when Wi-Fi OK; fast blink when Wi-Fi down
-# - Web: http://<board-ip>:8080/ shows correct IST regardless of client timezone
+# - Web: http://<board-ip>/clock (mounted on the OTA server when run from the IDE)
+#        or http://<board-ip>:8080/ when run standalone
+#   shows correct IST regardless of client timezone
 
-import network, time, ntptime, socket, sys, gc, math
+import network, time, ntptime, socket, sys, gc, math, asyncio, _thread
 from machine import Pin, PWM, WDT
 
 # ==== Wi-Fi ====
@@ -14,9 +16,11 @@ PASSWORD = "Your_WiFi_Password"
 # ==== Time / server ====
 IST_OFFSET_S = 5*3600 + 30*60
 UNIX_EPOCH_OFFSET_S = 946_684_800   # MP on ESP32 uses 2000-01-01 epoch
-HTTP_PORT = 8080                     # <- moved to avoid conflict with OTA UI (port 80)
+HTTP_PORT = 8080                     # standalone only; under OTA we mount on port 80
+CLOCK_PATH = "/clock"
 NTP_HOST = "time.google.com"
 NTP_RESYNC_MS = 3600_000             # 1h
+WIFI_RETRY_MS = 10_000               # mounted: how often to kick a STA reconnect
 
 # ==== LED ====
 LED_PIN = 21
@@ -27,7 +31,13 @@ pwm = PWM(Pin(LED_PIN), freq=1000)   # ctor without duty_u16 (better cross-build
 pwm.duty_u16(0)
 
 # ==== Watchdog ====
-wdt = WDT(timeout=4000)
+# Standalone only: under OTA the server shares our loop, and a WDT can't be
+# disabled again, so stopping the task would reset the board.
+wdt = WDT(timeout=4000) if __name__ == "__main__" else None
+
+def wdt_feed():
+    if wdt is not None:
+        wdt.feed()
 
 # ==== HTML (uses UTC getters + IST offset; no double-offset) ====
 HTML = b"""\
@@ -57,6 +67,7 @@ code{background:#0b1222;padding:2px 6px;border-radius:6px}
 <script>
 const IST_MS = (5*3600 + 30*60)*1000; // +5:30 in ms
 let delta = 0; // (ESP unix ms) - Date.now()
+const EPOCH_URL = location.pathname.startsWith('/clock') ? '/clock/epoch' : '/epoch';
 
 const pad=n=>n.toString().padStart(2,'0');
 function draw(){
@@ -69,7 +80,7 @@ function draw(){
 }
 async function start(){
   try{
-    const r = await fetch('/epoch'); // {epoch_ms: <unix_ms_utc_from_board>}
+    const r = await fetch(EPOCH_URL); // {epoch_ms: <unix_ms_utc_from_board>}
     const j = await r.json();
     delta = j.epoch_ms - Date.now();
     wifi.textContent = "Wi-Fi: OK";
@@ -95,12 +106,22 @@ def wifi_connect(timeout_ms=15000):
     if not sta.active():
         sta.active(True)
     if not sta.isconnected():
-        sta.connect(SSID, PASS)
+        sta.connect(SSID, PASSWORD)
         t0 = time.ticks_ms()
         while (not sta.isconnected()) and time.ticks_diff(time.ticks_ms(), t0) < timeout_ms:
-            time.sleep_ms(100); wdt.feed()
+            time.sleep_ms(100); wdt_feed()
     return sta.isconnected()
 
+def wifi_kick():
+    # start a reconnect and return immediately (no waiting on the event loop)
+    try:
+        if not sta.active():
+            sta.active(True)
+        if not sta.isconnected():
+            sta.connect(SSID, PASSWORD)
+    except OSError:
+        pass
+
 def ntp_sync():
     try:
         ntptime.host = NTP_HOST
@@ -134,7 +155,42 @@ def http_json_epoch(epoch_ms: int) -> bytes:
             b"Connection: close\r\n\r\n")
     return hdr + body
 
-# ==== HTTP server ====
+# ==== OTA-mounted app (shares the OTA server and its event loop) ====
+def clock_handler(conn, req):
+    if req["sub"] == "epoch":
+        conn.sendall(http_json_epoch(unix_epoch_ms_now()))
+    else:
+        conn.sendall(HTML)
+
+async def main():
+    # Nothing here may block: the OTA server runs on this loop too.
+    # Reconnects are only kicked off, and NTP (blocking UDP) runs in a thread.
+    import ota
+    ota.route(CLOCK_PATH, clock_handler, prefix=True, auth=False)
+    print("[HTTP] mounted on OTA server at", CLOCK_PATH)
+    last_ntp = None
+    last_reconn_try = time.ticks_ms()
+    try:
+        while True:
+            now = time.ticks_ms()
+            ok = wifi_connected()
+
+            led_update(now, ok)
+
+            if not ok and time.ticks_diff(now, last_reconn_try) >= WIFI_RETRY_MS:
+                wifi_kick()
+                last_reconn_try = now
+
+            if ok and (last_ntp is None or time.ticks_diff(now, last_ntp) >= NTP_RESYNC_MS):
+                _thread.start_new_thread(ntp_sync, ())
+                last_ntp = now
+
+            await asyncio.sleep_ms(20)
+    finally:
+        ota.unroute(CLOCK_PATH)
+        pwm.duty_u16(0)
+
+# ==== standalone HTTP server ====
 def serve(ip="0.0.0.0", port=HTTP_PORT):
     s = socket.socket()
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -154,7 +210,7 @@ def serve(ip="0.0.0.0", port=HTTP_PORT):
         ok = wifi_connected()
 
         led_update(now, ok)
-        wdt.feed()
+        wdt_feed()
 
         if not ok and time.ticks_diff(now, last_reconn_try) >= 3000:
             wifi_connect(3000)
@@ -185,7 +241,7 @@ def serve(ip="0.0.0.0", port=HTTP_PORT):
 
             if path == b"/" or path.startswith(b"/index"):
                 conn.sendall(HTML)
-            elif path.startswith(b"/epoch"):
+            elif path.startswith(b"/epoch") or path.startswith(b"/clock/epoch"):
                 conn.sendall(http_json_epoch(unix_epoch_ms_now()))
             else:
                 conn.sendall(b"HTTP/1.1 404 Not Found\r\nConnection: close\r\n\r\nNot found")
@@ -197,20 +253,22 @@ def serve(ip="0.0.0.0", port=HTTP_PORT):
 
         gc.collect()
 
-# ==== boot (for standalone run via OTA runner) ====
-print("\n[BOOT] IST Web Clock (NTP via time.google.com) + LED breathing/fast-blink")
-if wifi_connect():
-    print("[Wi-Fi] OK:", sta.ifconfig())
-    print("[NTP]", "OK" if ntp_sync() else "FAIL")
-else:
-    print("[Wi-Fi] FAIL — will serve and auto-reconnect")
-
-try:
-    serve()
-except KeyboardInterrupt:
-    print("\n[STOP] user")
-except Exception as e:
-    sys.print_exception(e)
-    time.sleep(1)
-    import machine
-    machine.reset()
+# ==== boot ====
+# Under the OTA runner main() is scheduled as a task; run directly, serve on our own port.
+if __name__ == "__main__":
+    print("\n[BOOT] IST Web Clock (NTP via time.google.com) + LED breathing/fast-blink")
+    if wifi_connect():
+        print("[Wi-Fi] OK:", sta.ifconfig())
+        print("[NTP]", "OK" if ntp_sync() else "FAIL")
+    else:
+        print("[Wi-Fi] FAIL — will serve and auto-reconnect")
+
+    try:
+        serve()
+    except KeyboardInterrupt:
+        print("\n[STOP] user")
+    except Exception as e:
+        sys.print_exception(e)
+        time.sleep(1)
+        import machine
+        machine.reset()
@@ -0,0 +1,16 @@
+# Async LED blink — runs as a task on the OTA server's loop (no extra thread)
+import asyncio
+from machine import Pin
+try:
+    led = Pin("LED", Pin.OUT)
+except:
+    led = Pin(21, Pin.OUT)
+
+async def main():
+    n = 0
+    while True:
+        led.on();  await asyncio.sleep_ms(500)
+        led.off(); await asyncio.sleep_ms(500)
+        n += 1
+        if n % 10 == 0:
+            print("blinks:", n)
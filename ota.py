@@ -2,7 +2,7 @@
 # Dark IDE UI + Logs + Web Shell + Basic Auth
 # (no f-strings / no '%' formatting / no sys.stdout reassignment)
 
-import socket, os, time, sys, _thread, machine
+import socket, os, time, sys, gc, _thread, machine
 
 __version__ = "devtesting-1.0"
 
@@ -31,7 +31,7 @@ def _auth_ok(headers):
     return headers.get("authorization", "") == _AUTH_TOKEN
 
 def _unauth(conn):
-    _send(conn,
+    _status(conn,
           "HTTP/1.1 401 Unauthorized\r\n"
           "WWW-Authenticate: Basic realm=\"ESP32-OTA\"\r\n"
           "Connection: close\r\n"
@@ -52,43 +52,415 @@ def _log_add(s):
 _RUN_ACTIVE = False
 _RUN_NAME = None
 
+def _log_print(*args, **kwargs):
+    # print replacement for user code: goes to LOG_BUF
+    sep = kwargs.get("sep", " ")
+    end = kwargs.get("end", "\n")
+    try:
+        s = sep.join([str(a) for a in args]) + end
+    except:
+        s = "[unprintable]\n"
+    _log_add(s)
+
+def _log_exc(e):
+    try:
+        import uio
+        s = uio.StringIO()
+        try:
+            sys.print_exception(e, s)
+            _log_add(s.getvalue())
+        except:
+            _log_add("Exception: " + str(e) + "\n")
+    except:
+        _log_add("Exception: " + str(e) + "\n")
+
 def _runner(fname):
     # Run user code; capture prints/exceptions into LOG_BUF without touching sys.stdout
     global _RUN_ACTIVE, _RUN_NAME
     _RUN_ACTIVE, _RUN_NAME = True, fname
+    tr = _prof_for(fname)
     try:
         code = open(fname, "r").read()
+        g = {"__name__": "__main__", "print": _log_print}
+        if tr: sys.settrace(_prof_trace)  # per-thread; only this job is traced
+        exec(compile(code, fname, "exec"), g)
+    except Exception as e:
+        _log_exc(e)
+    finally:
+        if tr: sys.settrace(None)
+        _RUN_ACTIVE, _RUN_NAME = False, None
 
-        # local print that logs
-        def log_print(*args, **kwargs):
-            sep = kwargs.get("sep", " ")
-            end = kwargs.get("end", "\n")
-            try:
-                s = sep.join([str(a) for a in args]) + end
-            except:
-                s = "[unprintable]\n"
-            _log_add(s)
+# ---------- profiler (opt-in, per job) ----------
+# Needs a firmware built with sys.settrace (MICROPY_PY_SYS_SETTRACE).
+# The trace hook counts calls and lines, and every `interval` us it records
+# the current stack; results are bounded tables of flamegraph-style keys.
+PROF_MAX_KEYS = 256   # per table; overflow goes to "[dropped]"
+PROF_MAX_DEPTH = 16
+_OTA_FILE = globals().get("__file__", "ota.py").split("/")[-1]  # stack walks stop at our own frames
+_PROF = None          # active profile dict, see prof_start()
 
-        g = {"__name__": "__main__", "print": log_print}
-        exec(compile(code, fname, "exec"), g)
+def _prof_for(fname):
+    return _PROF is not None and _PROF["name"] == fname and hasattr(sys, "settrace")
 
-    except Exception as e:
+def prof_start(fname, interval_ms=10):
+    # Profile fname from its next step (tasks) or next run (threads).
+    global _PROF
+    if not hasattr(sys, "settrace"):
+        return False
+    _PROF = {"name": fname, "interval": max(1, int(interval_ms)) * 1000,
+             "last": time.ticks_us(), "prev": None, "stacks": {}, "calls": {},
+             "lines": {}, "dropped": {"stacks": 0, "calls": 0, "lines": 0}}
+    return True
+
+def prof_stop():
+    # Stop sampling; collected data stays readable until the next prof_start()
+    global _PROF
+    p = _PROF
+    if p is not None:
+        p["name"] = None
+    return p is not None
+
+def _prof_bump(p, name, key, n=1):
+    # p[name] is the table; overflow is counted per table in p["dropped"][name]
+    table = p[name]
+    if key in table:
+        table[key] += n
+    elif len(table) < PROF_MAX_KEYS:
+        table[key] = n
+    else:
+        p["dropped"][name] += n
+
+def _frame_key(f):
+    c = f.f_code
+    return c.co_filename + ":" + c.co_name
+
+def _prof_tick(p, base, key, lineno, event):
+    # a sample covers the time since the last one and is credited to the
+    # previous event's line, i.e. the one that was running meanwhile
+    try:
+        if event == "line":
+            _prof_bump(p, "lines", key + ":" + str(lineno))
+        now = time.ticks_us()
+        dt = time.ticks_diff(now, p["last"])
+        if dt >= p["interval"]:
+            p["last"] = now
+            if p["prev"] is not None:
+                _prof_bump(p, "stacks", p["prev"], dt // p["interval"])
+        p["prev"] = base + ":" + str(lineno)
+    except:
+        pass
+
+def _prof_trace(frame, event, arg):
+    # Global hook, sees "call" events. The stack prefix is built once here and
+    # kept by the per-frame tracer, so line events don't walk the stack.
+    p = _PROF
+    if p is None or p["name"] is None:
+        return None
+    try:
+        key = _frame_key(frame)
+        _prof_bump(p, "calls", key)
+        parts = [key]
+        f = frame.f_back
+        while f is not None and len(parts) < PROF_MAX_DEPTH:
+            if f.f_code.co_filename.split("/")[-1] == _OTA_FILE:
+                break
+            parts.append(_frame_key(f))
+            f = f.f_back
+        parts.reverse()
+        base = ";".join(parts)
+    except:
+        return None
+
+    def local(frame, event, arg):
+        if _PROF is not p or p["name"] is None:
+            return None
+        _prof_tick(p, base, key, frame.f_lineno, event)
+        return local
+
+    _prof_tick(p, base, key, frame.f_lineno, event)
+    return local
+
+def prof_collapsed():
+    # "frame;frame;leaf:line count" lines, ready for flamegraph.pl / speedscope
+    p = _PROF
+    if p is None:
+        return ""
+    out = ""
+    for k in sorted(p["stacks"]):
+        out += k.replace(" ", "_") + " " + str(p["stacks"][k]) + "\n"
+    if p["dropped"]["stacks"]:
+        out += "[dropped] " + str(p["dropped"]["stacks"]) + "\n"
+    return out
+
+def _prof_counts():
+    p = _PROF
+    if p is None:
+        return "no profile\n"
+    out = ""
+    for name in ("calls", "lines"):
+        t = p[name]
+        out += "# " + name + "\n"
+        for k in sorted(t, key=lambda k: -t[k]):
+            out += str(t[k]) + " " + k + "\n"
+        if p["dropped"][name]:
+            out += str(p["dropped"][name]) + " [dropped]\n"
+    return out
+
+# ---------- cooperative runner (asyncio) ----------
+# Scripts that define `async def main()` run as tasks on the server's loop
+# instead of getting their own thread. Everything else still uses _runner.
+try:
+    import asyncio
+except:
+    try:
+        import uasyncio as asyncio
+    except:
+        asyncio = None
+
+_LOOP_ACTIVE = False  # True while start() is serving from asyncio
+_TASKS = {}           # fname -> job dict (name, task, state, t0, t1, busy, steps)
+_last_job = [None]    # name of the task that ran the most recent step
+
+def _is_async_app(code):
+    # a top-level `async def main(` at column 0, outside triple-quoted strings
+    quote = None
+    for ln in code.split("\n"):
+        if quote is None and ln.startswith("async def main"):
+            if ln[14:].lstrip().startswith("("):
+                return True
+        for q in ('"""', "'''"):
+            if (quote is None or quote == q) and ln.count(q) % 2:
+                quote = None if quote == q else q
+    return False
+
+def _timed(coro, job):
+    # Drive `coro` step by step so we can account the CPU time it uses
+    # between yields. Values and exceptions are passed straight through.
+    val, exc = None, None
+    while True:
+        t = time.ticks_us()
+        _last_job[0] = job["name"]
+        tr = _prof_for(job["name"])
+        if tr:
+            _PROF["last"] = t  # don't charge time spent in other tasks
+            sys.settrace(_prof_trace)
         try:
-            import uio
-            s = uio.StringIO()
-            try:
-                sys.print_exception(e, s)
-                _log_add(s.getvalue())
-            except:
-                _log_add("Exception: " + str(e) + "\n")
-        except:
-            _log_add("Exception: " + str(e) + "\n")
+            if exc is None:
+                y = coro.send(val)
+            else:
+                y = coro.throw(exc)
+        except StopIteration as e:
+            return e.value
+        finally:
+            if tr: sys.settrace(None)
+            job["busy"] += time.ticks_diff(time.ticks_us(), t)
+            job["steps"] += 1
+        try:
+            val, exc = (yield y), None
+        except BaseException as e:
+            val, exc = None, e
+
+async def _task_load(fname, obj):
+    # The module body runs in a thread so a blocking top level can't freeze
+    # the loop; we only poll for it here. (A body that never returns keeps
+    # its thread, but the server and /stop stay usable.)
+    g = {"__name__": "__task__", "print": _log_print}
+    box = []
+    def load():
+        try:
+            exec(obj, g); box.append(None)
+        except Exception as e:
+            box.append(e)
+    _thread.start_new_thread(load, ())
+    while not box:
+        await asyncio.sleep_ms(10)
+    if box[0] is not None:
+        raise box[0]
+    main = g.get("main")
+    if main is None:
+        raise ValueError(fname + " has no async main()")
+    return main
+
+async def _task_main(fname, obj, job):
+    try:
+        main = await _task_load(fname, obj)
+        job["state"] = "running"
+        await _timed(main(), job)
+        job["state"] = "done"
+    except asyncio.CancelledError:
+        job["state"] = "cancelled"
+        _log_add("[" + fname + "] cancelled\n")
+    except Exception as e:
+        job["state"] = "error"
+        _log_exc(e)
     finally:
-        _RUN_ACTIVE, _RUN_NAME = False, None
+        job["t1"] = time.ticks_ms()
+        if _last_job[0] == fname:
+            _last_job[0] = None  # don't blame later heap samples on a dead task
+
+def run_task(fname):
+    # Compile fname here so syntax errors reach the caller, then load and run
+    # its async main() as a task on the running loop.
+    code = open(fname, "r").read()
+    if not _is_async_app(code):
+        raise ValueError(fname + " has no top-level async def main()")
+    obj = compile(code, fname, "exec")
+    stop_task(fname)
+    job = {"name": fname, "task": None, "state": "loading", "t0": time.ticks_ms(), "t1": None, "busy": 0, "steps": 0}
+    _TASKS[fname] = job
+    job["task"] = asyncio.create_task(_task_main(fname, obj, job))
+    return job
+
+def stop_task(fname):
+    job = _TASKS.get(fname)
+    if job is None or job["state"] not in ("loading", "running"):
+        return False
+    job["task"].cancel()
+    return True
+
+def _tasks_text():
+    out = ""
+    now = time.ticks_ms()
+    for name in sorted(_TASKS):
+        job = _TASKS[name]
+        end = job["t1"] if job["t1"] is not None else now
+        out += (name + " " + job["state"]
+                + " wall_ms=" + str(time.ticks_diff(end, job["t0"]))
+                + " busy_ms=" + str(job["busy"] // 1000)
+                + " steps=" + str(job["steps"]) + "\n")
+    return out or "no tasks\n"
+
+def _nested_run(coro, *args, **kwargs):
+    # replaces asyncio.run while the server loop owns it
+    try: coro.close()
+    except: pass
+    raise RuntimeError("asyncio.run() can't start while the OTA server loop is running; "
+                       "put it under if __name__ == \"__main__\": (async def main() is run as a task)")
 
 def run_async(fname):
+    # async apps share the server loop when it is running; others get a thread
+    if _LOOP_ACTIVE:
+        try:
+            code = open(fname, "r").read()
+        except:
+            code = ""
+        if _is_async_app(code):
+            try:
+                run_task(fname)
+            except Exception as e:
+                _log_exc(e)
+                raise
+            return
     _thread.start_new_thread(_runner, (fname,))
 
+# ---------- heap timeline ----------
+# Fixed ring of int32 records sampled in the background; no per-sample dicts.
+HEAP_SAMPLE_MS = 1000       # 0 disables the sampler
+HEAP_RING = 120             # records kept (~2.9KB)
+HEAP_LOW_FREE = 16384       # free bytes; dropping below this writes a dump
+HEAP_DUMP_FILE = "heapdump.txt"
+
+try:
+    from array import array
+except:
+    from uarray import array
+try:
+    import esp32
+except:
+    esp32 = None
+
+_HF = 6  # fields per record: t_ms, free, alloc, largest, gcs, job
+_HEAP = array("i", bytearray(4 * _HF * HEAP_RING))
+_HEAP_JOBS = []  # job names; record stores index + 1 (0 = idle, -1 = table full)
+_heap_st = {"n": 0, "gcs": 0, "prev_alloc": 0, "low": False}
+
+def _largest_free():
+    # largest free block of the IDF data heap, which the MicroPython heap grows into
+    if esp32 is None:
+        return -1
+    try:
+        return max([h[2] for h in esp32.idf_heap_info(esp32.HEAP_DATA)])
+    except:
+        return -1
+
+def _job_id(name):
+    if name is None:
+        return 0
+    if name in _HEAP_JOBS:
+        return _HEAP_JOBS.index(name) + 1
+    if len(_HEAP_JOBS) < 16:
+        _HEAP_JOBS.append(name)
+        return len(_HEAP_JOBS)
+    return -1
+
+def heap_sample():
+    st = _heap_st
+    free, alloc = gc.mem_free(), gc.mem_alloc()
+    # no collection counter in MicroPython: count drops in allocated bytes
+    if alloc < st["prev_alloc"]:
+        st["gcs"] += 1
+    st["prev_alloc"] = alloc
+    i = (st["n"] % HEAP_RING) * _HF
+    _HEAP[i] = time.ticks_ms()
+    _HEAP[i + 1] = free
+    _HEAP[i + 2] = alloc
+    _HEAP[i + 3] = _largest_free()
+    _HEAP[i + 4] = st["gcs"]
+    _HEAP[i + 5] = _job_id(_RUN_NAME or _last_job[0])
+    st["n"] += 1
+
+    if free < HEAP_LOW_FREE and not st["low"]:
+        st["low"] = True
+        _heap_dump(free)
+    elif free > HEAP_LOW_FREE + HEAP_LOW_FREE // 4:
+        st["low"] = False  # re-arm with some hysteresis
+
+_HEAP_HDR = "t_ms,free,alloc,largest,gcs,job\n"
+
+def _heap_rows(n=None):
+    # one CSV line per record, oldest first
+    total = _heap_st["n"]
+    count = min(total, HEAP_RING)
+    if n is not None:
+        count = min(count, n)
+    for k in range(total - count, total):
+        i = (k % HEAP_RING) * _HF
+        j = _HEAP[i + 5]
+        name = "" if j == 0 else ("?" if j < 0 else _HEAP_JOBS[j - 1])
+        yield (str(_HEAP[i]) + "," + str(_HEAP[i + 1]) + "," + str(_HEAP[i + 2]) + ","
+               + str(_HEAP[i + 3]) + "," + str(_HEAP[i + 4]) + "," + name + "\n")
+
+def heap_series(n=None):
+    return _HEAP_HDR + "".join(_heap_rows(n))
+
+def _heap_dump(free):
+    # runs when memory is low: stream records to the file instead of
+    # building the CSV in RAM, and log only after the dump is on flash
+    try:
+        with open(HEAP_DUMP_FILE, "w") as f:
+            f.write(_HEAP_HDR)
+            for row in _heap_rows():
+                f.write(row)
+            f.write("\n# log\n")
+            f.write(LOG_BUF)
+            f.write("\n# tasks\n")
+            f.write(_tasks_text())
+    except Exception as e:
+        _log_add("[heap] dump failed: " + str(e) + "\n")
+    _log_add("[heap] free " + str(free) + " < " + str(HEAP_LOW_FREE) + ", dump -> " + HEAP_DUMP_FILE + "\n")
+
+async def _heap_task():
+    while True:
+        try: heap_sample()
+        except: pass
+        await asyncio.sleep_ms(HEAP_SAMPLE_MS)
+
+def _heap_thread():
+    while True:
+        try: heap_sample()
+        except: pass
+        time.sleep_ms(HEAP_SAMPLE_MS)
+
 # ---------- simple web shell (REPL) ----------
 REPL_G = {"__name__": "__repl__"}  # persistent globals across commands
 
@@ -142,11 +514,18 @@ def _send(conn, s):
     if isinstance(s, str): s = s.encode()
     conn.sendall(s)
 
+# id(conn) of connections whose final status line is out (interim 100 excluded)
+_STARTED = set()
+
+def _status(conn, head):
+    _STARTED.add(id(conn))
+    _send(conn, head)
+
 def _ok(conn, ctype="text/html"):
-    _send(conn, "HTTP/1.1 200 OK\r\nConnection: close\r\nContent-Type: " + ctype + "\r\nCache-Control: no-store\r\n\r\n")
+    _status(conn, "HTTP/1.1 200 OK\r\nConnection: close\r\nContent-Type: " + ctype + "\r\nCache-Control: no-store\r\n\r\n")
 
 def _bad(conn, msg="Bad Request"):
-    _send(conn, "HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n"); _send(conn, msg)
+    _status(conn, "HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n"); _send(conn, msg)
 
 def _read_head(conn, maxlen=65536):
     data = b""
@@ -154,6 +533,9 @@ def _read_head(conn, maxlen=65536):
         c = conn.recv(1024)
         if not c: break
         data += c
+    return _parse_head(conn, data)
+
+def _parse_head(conn, data):
     if b"\r\n\r\n" not in data: return None, None, None, None
     head, body = data.split(b"\r\n\r\n", 1)
     lines = head.decode().split("\r\n")
@@ -171,6 +553,15 @@ def _read_head(conn, maxlen=65536):
         except: pass
     return method, path, hdrs, body
 
+def _read_body(conn, headers, body_start):
+    total = int(headers.get("content-length", "0"))
+    body = body_start
+    while len(body) < total:
+        c = conn.recv(min(2048, total - len(body)))
+        if not c: break
+        body += c
+    return body
+
 def _parse_qs(path):
     if "?" not in path: return path, {}
     r, qs = path.split("?", 1)
@@ -227,6 +618,9 @@ def _html(ip, mode, msg):
             )
 
     run_info = "IDLE" if not _RUN_ACTIVE else "ACTIVE · " + (_RUN_NAME or "")
+    tasks = [n for n in sorted(_TASKS) if _TASKS[n]["state"] in ("loading", "running")]
+    if tasks:
+        run_info += " · Tasks " + ", ".join(tasks)
     if msg is None:
         msg = ""
 
@@ -290,6 +684,10 @@ def _html(ip, mode, msg):
         '<form method="GET" action="/run" class="row">'
         '<input name="f" value="app.py" placeholder="filename.py">'
         '<button type="submit">Run</button>'
+        '<button type="submit" formaction="/stop">Stop task</button>'
+        '<a href="/tasks" target="_blank">tasks</a>'
+        '<a href="/prof" target="_blank">profile</a>'
+        '<a href="/heap" target="_blank">heap</a>'
         '</form></div>'
     )
 
@@ -351,17 +749,12 @@ def _html(ip, mode, msg):
 
 
 # ---------- handlers ----------
-def _handle_root(conn):
+# every handler takes (conn, req); req is built once in _dispatch (both servers)
+def _handle_root(conn, req):
     _ok(conn); _send(conn, _html(ip, mode, ""))
 
-def _handle_save(conn, headers, body_start):
-    total = int(headers.get("content-length", "0"))
-    body = body_start
-    while len(body) < total:
-        c = conn.recv(min(2048, total - len(body)))
-        if not c: break
-        body += c
-    form = _urldecode(body)
+def _handle_save(conn, req):
+    form = _urldecode(req["body"])
     name = _sanitize((form.get("name", ["app.py"])[0]).strip() or "app.py")
     code = form.get("code", [""])[0]
     run_now = ("run" in form)
@@ -381,17 +774,18 @@ def _handle_save(conn, headers, body_start):
 
     _ok(conn); _send(conn, _html(ip, mode, "OK: Saved " + name + "."))
 
-def _handle_run(conn, path):
-    route, q = _parse_qs(path)
-    name = _sanitize((q.get("f", ["app.py"])[0]).strip() or "app.py")
+def _handle_run(conn, req):
+    name = _sanitize((req["query"].get("f", ["app.py"])[0]).strip() or "app.py")
     if name not in os.listdir():
         _ok(conn); _send(conn, _html(ip, mode, "ERR: " + name + " not found")); return
-    run_async(name)
+    try:
+        run_async(name)
+    except Exception as e:
+        _ok(conn); _send(conn, _html(ip, mode, "ERR: Failed to run " + name + ": " + str(e))); return
     _ok(conn); _send(conn, _html(ip, mode, "OK: Running " + name + "…"))
 
-def _handle_del(conn, path):
-    route, q = _parse_qs(path)
-    name = _sanitize((q.get("f", [""])[0]).strip())
+def _handle_del(conn, req):
+    name = _sanitize((req["query"].get("f", [""])[0]).strip())
     if not name:
         _ok(conn); _send(conn, _html(ip, mode, "ERR: No filename")); return
     if name in PROTECTED:
@@ -404,66 +798,253 @@ def _handle_del(conn, path):
     except Exception as e:
         _ok(conn); _send(conn, _html(ip, mode, "ERR: Delete failed: " + str(e)))
 
-def _handle_log(conn):
+def _handle_reset(conn, req):
+    _ok(conn, "text/plain"); _send(conn, "Reset…")
+    def _r(): time.sleep(0.4); machine.reset()
+    _thread.start_new_thread(_r, ())
+
+def _handle_log(conn, req):
     _ok(conn, "text/plain"); _send(conn, LOG_BUF)
 
-def _handle_exec(conn, headers, body_start):
+def _handle_exec(conn, req):
+    form = _urldecode(req["body"])
+    code = form.get("code", [""])[0]
+    res = _repl_exec(code)
+    _ok(conn, "text/plain"); _send(conn, res)
+
+def _handle_tasks(conn, req):
+    _ok(conn, "text/plain"); _send(conn, _tasks_text())
+
+def _handle_stop(conn, req):
+    name = _sanitize((req["query"].get("f", [""])[0]).strip())
+    if stop_task(name):
+        _ok(conn); _send(conn, _html(ip, mode, "OK: Stopping " + name))
+    else:
+        _ok(conn); _send(conn, _html(ip, mode, "ERR: " + name + " is not a running task"))
+
+def _handle_prof(conn, req):
+    if req["query"].get("fmt", [""])[0] == "counts":
+        _ok(conn, "text/plain"); _send(conn, _prof_counts()); return
+    _ok(conn, "text/plain"); _send(conn, prof_collapsed())
+
+def _handle_prof_start(conn, req):
+    name = _sanitize((req["query"].get("f", [""])[0]).strip())
+    try:
+        ms = int(req["query"].get("ms", ["10"])[0])
+    except:
+        ms = 10
+    if not name:
+        _ok(conn, "text/plain"); _send(conn, "ERR: No filename"); return
+    if not prof_start(name, ms):
+        _ok(conn, "text/plain"); _send(conn, "ERR: firmware has no sys.settrace"); return
+    _ok(conn, "text/plain"); _send(conn, "OK: Profiling " + name + " every " + str(ms) + " ms")
+
+def _handle_prof_stop(conn, req):
+    prof_stop()
+    _ok(conn, "text/plain"); _send(conn, "OK: Profiler stopped")
+
+def _handle_heap(conn, req):
+    try:
+        n = int(req["query"].get("n", [""])[0])
+    except:
+        n = None
+    _ok(conn, "text/plain"); _send(conn, heap_series(n))
+
+# ---------- routes ----------
+# exact routes: (method, path) -> (handler, auth)
+_ROUTES = {
+    ("GET", "/"): (_handle_root, True),
+    ("GET", "/run"): (_handle_run, True),
+    ("GET", "/del"): (_handle_del, True),
+    ("GET", "/reset"): (_handle_reset, True),
+    ("GET", "/log"): (_handle_log, True),
+    ("GET", "/tasks"): (_handle_tasks, True),
+    ("GET", "/stop"): (_handle_stop, True),
+    ("GET", "/prof"): (_handle_prof, True),
+    ("GET", "/prof/start"): (_handle_prof_start, True),
+    ("GET", "/prof/stop"): (_handle_prof_stop, True),
+    ("GET", "/heap"): (_handle_heap, True),
+    ("POST", "/save"): (_handle_save, True),
+    ("POST", "/exec"): (_handle_exec, True),
+}
+_BUILTIN = set([k[1] for k in _ROUTES])
+# prefix mounts: [prefix, method, handler, auth], longest prefix first
+_MOUNTS = []
+
+def route(path, handler, methods=("GET",), prefix=False, auth=True):
+    # Mount handler(conn, req) on the OTA server.
+    # prefix=True also matches path + "/..."; req["sub"] holds the rest.
+    # A handler may write to conn itself or return a str/bytes HTML body.
+    if prefix and path != "/":
+        path = path.rstrip("/")
+    if path in _BUILTIN:
+        raise ValueError(path + " is reserved by ota")
+    for m in methods:
+        m = m.upper()
+        if prefix:
+            _MOUNTS[:] = [x for x in _MOUNTS if not (x[0] == path and x[1] == m)]
+            _MOUNTS.append([path, m, handler, auth])
+        else:
+            _ROUTES[(m, path)] = (handler, auth)
+    _MOUNTS.sort(key=lambda x: -len(x[0]))
+
+def unroute(path):
+    # drop everything an app mounted on path (exact or prefix)
+    if path != "/":
+        path = path.rstrip("/")
+    if path in _BUILTIN:
+        return
+    for k in [k for k in _ROUTES if k[1] == path]:
+        del _ROUTES[k]
+    _MOUNTS[:] = [x for x in _MOUNTS if x[0] != path]
+
+def _lookup(method, path):
+    hit = _ROUTES.get((method, path))
+    if hit is not None:
+        return hit[0], hit[1], ""
+    for p, m, h, a in _MOUNTS:
+        if m != method:
+            continue
+        if path == p:
+            return h, a, ""
+        if path.startswith(p + "/"):
+            return h, a, path[len(p):].lstrip("/")
+    return None, True, ""
+
+def reply(conn, body, ctype="text/html", status="200 OK"):
+    # helper for app handlers: full response in one call
+    _status(conn, "HTTP/1.1 " + status + "\r\nConnection: close\r\nContent-Type: " + ctype + "\r\nCache-Control: no-store\r\n\r\n")
+    _send(conn, body)
+
+# ---------- server ----------
+REQ_TIMEOUT_S = 10  # per request head/body; idle clients are dropped after this
+
+def _dispatch(conn, method, path, headers):
+    # route + auth gate; returns (handler, req) or (None, None) once answered
+    route_path, query = _parse_qs(path)
+    handler, need_auth, sub = _lookup(method, route_path)
+    if need_auth and not _auth_ok(headers):
+        _unauth(conn); return None, None
+    if handler is None:
+        _bad(conn, "Unknown POST" if method == "POST" else "Bad Request"); return None, None
+    return handler, {"method": method, "path": route_path, "sub": sub, "query": query,
+                     "headers": headers, "body": b""}
+
+def _call(conn, handler, req):
+    k = id(conn)
+    _STARTED.discard(k)
+    try:
+        res = handler(conn, req)
+        if res is not None:
+            _ok(conn); _send(conn, res)
+    except Exception as e:
+        _log_exc(e)
+        # a response that already has its status line gets no error page appended
+        if k not in _STARTED:
+            _bad(conn, "Exception: " + str(e))
+    finally:
+        _STARTED.discard(k)
+
+def _handle_conn(conn):
+    # blocking server (no asyncio)
+    try:
+        method, path, headers, body_start = _read_head(conn)
+        if method is None:
+            _bad(conn, "Bad headers"); return
+        handler, req = _dispatch(conn, method, path, headers)
+        if handler is None:
+            return
+        req["body"] = _read_body(conn, headers, body_start)
+        _call(conn, handler, req)
+    except Exception as e:
+        try: _bad(conn, "Exception: " + str(e))
+        except: pass
+    finally:
+        _STARTED.discard(id(conn))
+        try: conn.close()
+        except: pass
+
+class _StreamConn:
+    # socket-like shim so the sync handlers can write to an asyncio stream
+    def __init__(self, writer):
+        self.w = writer
+    def sendall(self, b):
+        if isinstance(b, str): b = b.encode()
+        self.w.write(b)
+    def send(self, b):
+        if isinstance(b, str): b = b.encode()
+        self.w.write(b)
+        return len(b)
+    write = send
+
+async def _aread_head(reader, maxlen=65536):
+    data = b""
+    while b"\r\n\r\n" not in data and len(data) < maxlen:
+        c = await reader.read(1024)
+        if not c: break
+        data += c
+    return data
+
+async def _aread_body(reader, headers, body_start):
     total = int(headers.get("content-length", "0"))
     body = body_start
     while len(body) < total:
-        c = conn.recv(min(2048, total - len(body)))
+        c = await reader.read(min(2048, total - len(body)))
         if not c: break
         body += c
-    form = _urldecode(body)
-    code = form.get("code", [""])[0]
-    res = _repl_exec(code)
-    _ok(conn, "text/plain"); _send(conn, res)
+    return body
+
+async def _handle_client(reader, writer):
+    # request I/O awaits, so app tasks keep running while clients are slow
+    conn = _StreamConn(writer)
+    try:
+        data = await asyncio.wait_for(_aread_head(reader), REQ_TIMEOUT_S)
+        method, path, headers, body_start = _parse_head(conn, data)
+        if method is None:
+            _bad(conn, "Bad headers"); return
+        handler, req = _dispatch(conn, method, path, headers)
+        if handler is None:
+            return
+        await writer.drain()  # flush a pending "100 Continue"
+        req["body"] = await asyncio.wait_for(_aread_body(reader, headers, body_start), REQ_TIMEOUT_S)
+        _call(conn, handler, req)
+    except Exception as e:
+        try: _bad(conn, "Exception: " + str(e))
+        except: pass
+    finally:
+        _STARTED.discard(id(conn))
+        try: await writer.drain()
+        except: pass
+        try:
+            writer.close(); await writer.wait_closed()
+        except: pass
+
+async def _serve():
+    global _LOOP_ACTIVE
+    _LOOP_ACTIVE = True
+    real_run, asyncio.run = asyncio.run, _nested_run
+    if HEAP_SAMPLE_MS:
+        asyncio.create_task(_heap_task())
+    try:
+        srv = await asyncio.start_server(_handle_client, "0.0.0.0", PORT, backlog=2)
+        await srv.wait_closed()
+    finally:
+        asyncio.run = real_run
+        _LOOP_ACTIVE = False
 
-# ---------- server ----------
 def start(ip="0.0.0.0", mode="STA"):
     globals()["ip"] = ip
     globals()["mode"] = mode
-    s = socket.socket(); s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind(("0.0.0.0", PORT)); s.listen(2)
     print("HTTP server on", ip, "port", PORT)
 
+    if asyncio is not None:
+        asyncio.run(_serve())
+        return
+
+    s = socket.socket(); s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind(("0.0.0.0", PORT)); s.listen(2)
+    if HEAP_SAMPLE_MS:
+        _thread.start_new_thread(_heap_thread, ())
     while True:
         conn, _ = s.accept()
-        try:
-            method, path, headers, body_start = _read_head(conn)
-            if method is None:
-                _bad(conn, "Bad headers"); conn.close(); continue
-
-            # --- auth gate ---
-            if not _auth_ok(headers):
-                _unauth(conn); conn.close(); continue
-
-            if method == "GET":
-                route, _ = _parse_qs(path)
-                if route == "/": _handle_root(conn)
-                elif route == "/run": _handle_run(conn, path)
-                elif route == "/del": _handle_del(conn, path)
-                elif route == "/reset":
-                    _ok(conn, "text/plain"); _send(conn, "Reset…")
-                    def _r(): time.sleep(0.4); machine.reset()
-                    _thread.start_new_thread(_r, ())
-                elif route == "/log":
-                    _handle_log(conn)
-                else:
-                    _bad(conn)
-            elif method == "POST":
-                route, _ = _parse_qs(path)
-                if route == "/save":
-                    _handle_save(conn, headers, body_start)
-                elif route == "/exec":
-                    _handle_exec(conn, headers, body_start)
-                else:
-                    _bad(conn, "Unknown POST")
-            else:
-                _bad(conn)
-        except Exception as e:
-            try: _bad(conn, "Exception: " + str(e))
-            except: pass
-        finally:
-            try: conn.close()
-            except: pass
+        _handle_conn(conn)